@@ -0,0 +1,21 @@
+#!/bin/bash
+# Run the Video Workflow Server under Gunicorn with Uvicorn workers.
+#
+# Job state (WorkflowServer.jobs) lives in process memory, so WORKERS
+# defaults to 1. Raise it only once that state is shared (e.g. moved to
+# Redis); otherwise requests for a job can land on a worker that has
+# never seen it.
+WORKERS=${WORKERS:-1}
+
+echo "Starting Video Workflow Server (production)..."
+echo ""
+echo "Installing Python dependencies if needed..."
+pip install -r requirements.txt || pip3 install -r requirements.txt
+echo ""
+echo "Starting $WORKERS worker(s) on http://127.0.0.1:8000"
+echo "ComfyUI should be running on http://127.0.0.1:8001"
+echo ""
+gunicorn video_workflow_server:app \
+    -k uvicorn_worker.UvicornWorker \
+    -w "$WORKERS" \
+    --bind 127.0.0.1:8000
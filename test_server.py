@@ -5,25 +5,32 @@ This server simulates ComfyUI API endpoints for testing the frontend
 without requiring a real ComfyUI installation.
 """
 
+import hashlib
+import itertools
 import json
+import sys
 import uuid
 import time
 import asyncio
 import random
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
+from typing import Dict, Any, List, Optional, Set, Tuple
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import aiofiles
+import orjson
 import uvicorn
 
 # Create necessary directories
 UPLOAD_DIR = Path("test_uploads")
 OUTPUT_DIR = Path("test_outputs")
 VIDEO_DIR = OUTPUT_DIR / "video"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 VIDEO_DIR.mkdir(exist_ok=True)
@@ -35,7 +42,11 @@ if not SAMPLE_VIDEO.exists():
     with open(SAMPLE_VIDEO, "wb") as f:
         f.write(b"Dummy video content for testing")
 
-app = FastAPI(title="Mock ComfyUI Server", version="1.0.0")
+app = FastAPI(
+    title="Mock ComfyUI Server",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # Enable CORS for frontend testing
 app.add_middleware(
@@ -46,9 +57,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for tracking prompts
+# Compress larger JSON responses (fastest level)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
+# In-memory storage for tracking prompts (oldest entries evicted past MAX_PROMPTS)
+MAX_PROMPTS = 10_000
 prompts: Dict[str, Dict[str, Any]] = {}
-prompt_counter = 1
+_prompt_counter = itertools.count(1)
+
+# Prompts currently being advanced by the shared progress ticker
+TICK_INTERVAL = 0.3
+_running_prompts: Set[str] = set()
+_ticker_task: Optional[asyncio.Task] = None
+
+# Static responses, encoded once at import time
+def _encode_static(payload: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Encode a constant payload and derive its ETag"""
+    body = orjson.dumps(payload)
+    return body, f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+_ROOT_BYTES, _ROOT_ETAG = _encode_static({"message": "Mock ComfyUI Server", "status": "running"})
+
+_SYSTEM_STATS_BYTES, _SYSTEM_STATS_ETAG = _encode_static({
+    "system": {
+        "os": "linux",
+        "python_version": "3.10.0",
+        "comfy_version": "0.0.1-mock"
+    },
+    "devices": [
+        {
+            "name": "cuda:0",
+            "type": "cuda",
+            "index": 0,
+            "vram_total": 8589934592,
+            "vram_free": 6442450944,
+            "torch_vram_total": 8589934592,
+            "torch_vram_free": 6442450944
+        }
+    ]
+})
+
+_OBJECT_INFO_BYTES, _OBJECT_INFO_ETAG = _encode_static({
+    "KSamplerAdvanced": {
+        "input": {
+            "required": {
+                "model": ["MODEL"],
+                "positive": ["CONDITIONING"],
+                "negative": ["CONDITIONING"],
+                "latent_image": ["LATENT"],
+                "noise_seed": ["INT", {"default": 0}],
+                "steps": ["INT", {"default": 20}],
+                "cfg": ["FLOAT", {"default": 8.0}],
+                "sampler_name": ["COMBO[STRING]", {"default": "euler"}],
+                "scheduler": ["COMBO[STRING]", {"default": "normal"}],
+                "add_noise": ["COMBO[STRING]", {"default": "enable"}],
+                "start_at_step": ["INT", {"default": 0}],
+                "end_at_step": ["INT", {"default": 10000}],
+                "return_with_leftover_noise": ["COMBO[STRING]", {"default": "disable"}]
+            }
+        },
+        "output": ["LATENT"],
+        "output_is_list": [False],
+        "output_name": ["LATENT"],
+        "name": "KSamplerAdvanced",
+        "display_name": "KSampler (Advanced)",
+        "description": "",
+        "category": "sampling",
+        "output_node": False
+    }
+})
+
+def _static_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve a pre-encoded payload, answering 304 when the client's ETag matches"""
+    headers = {"ETag": etag, "Cache-Control": "max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Models
 class PromptRequest(BaseModel):
@@ -68,30 +152,13 @@ class SystemStats(BaseModel):
     devices: List[Dict[str, Any]]
 
 @app.get("/")
-async def root():
-    return {"message": "Mock ComfyUI Server", "status": "running"}
+async def root(request: Request):
+    return _static_response(request, _ROOT_BYTES, _ROOT_ETAG)
 
 @app.get("/system_stats")
-async def get_system_stats():
+async def get_system_stats(request: Request):
     """Mock system stats endpoint"""
-    return {
-        "system": {
-            "os": "linux",
-            "python_version": "3.10.0",
-            "comfy_version": "0.0.1-mock"
-        },
-        "devices": [
-            {
-                "name": "cuda:0",
-                "type": "cuda",
-                "index": 0,
-                "vram_total": 8589934592,
-                "vram_free": 6442450944,
-                "torch_vram_total": 8589934592,
-                "torch_vram_free": 6442450944
-            }
-        ]
-    }
+    return _static_response(request, _SYSTEM_STATS_BYTES, _SYSTEM_STATS_ETAG)
 
 @app.post("/upload/image")
 async def upload_image(
@@ -101,13 +168,13 @@ async def upload_image(
 ):
     """Mock image upload endpoint"""
     # Generate a unique filename
-    filename = f"upload_{int(time.time())}_{image.filename}"
+    filename = f"upload_{time.time_ns() // 1_000_000_000}_{image.filename}"
     filepath = UPLOAD_DIR / filename
 
-    # Save the file
-    content = await image.read()
-    with open(filepath, "wb") as f:
-        f.write(content)
+    # Stream the file to disk in chunks
+    async with aiofiles.open(filepath, "wb") as f:
+        while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
 
     print(f"[Mock Server] Uploaded image: {filename}")
 
@@ -116,11 +183,8 @@ async def upload_image(
 @app.post("/prompt")
 async def queue_prompt(request: PromptRequest, background_tasks: BackgroundTasks):
     """Mock prompt queue endpoint"""
-    global prompt_counter
-
-    prompt_id = str(uuid.uuid4())
-    prompt_number = prompt_counter
-    prompt_counter += 1
+    prompt_id = uuid.uuid4().hex
+    prompt_number = next(_prompt_counter)
 
     # Store the prompt
     prompts[prompt_id] = {
@@ -131,6 +195,8 @@ async def queue_prompt(request: PromptRequest, background_tasks: BackgroundTasks
         "created_at": datetime.now().isoformat(),
         "workflow": request.prompt
     }
+    while len(prompts) > MAX_PROMPTS:
+        del prompts[next(iter(prompts))]
 
     print(f"[Mock Server] Queued prompt: {prompt_id} (number: {prompt_number})")
 
@@ -140,24 +206,35 @@ async def queue_prompt(request: PromptRequest, background_tasks: BackgroundTasks
     return QueueResponse(prompt_id=prompt_id, number=prompt_number)
 
 async def process_prompt(prompt_id: str):
-    """Mock prompt processing with progress updates"""
+    """Mock prompt processing; progress is driven by the shared ticker"""
+    global _ticker_task
+
     await asyncio.sleep(0.5)  # Small delay before starting
+    if prompt_id not in prompts:
+        return
 
     # Send execution_start via WebSocket (simulated)
     print(f"[Mock Server] Processing prompt: {prompt_id}")
 
-    # Simulate progress updates
-    for progress in range(0, 101, 10):
-        await asyncio.sleep(0.3)  # Simulate work
-        if prompt_id in prompts:
-            prompts[prompt_id]["progress"] = progress
-
-    # Mark as completed
-    if prompt_id in prompts:
-        prompts[prompt_id]["status"] = "completed"
-        prompts[prompt_id]["progress"] = 100
-
-    print(f"[Mock Server] Completed prompt: {prompt_id}")
+    _running_prompts.add(prompt_id)
+    if _ticker_task is None or _ticker_task.done():
+        _ticker_task = asyncio.create_task(_tick_all_prompts())
+
+async def _tick_all_prompts():
+    """Advance every running mock prompt by 10% per tick, one wakeup for all"""
+    while _running_prompts:
+        await asyncio.sleep(TICK_INTERVAL)  # Simulate work
+        for prompt_id in list(_running_prompts):
+            prompt = prompts.get(prompt_id)
+            if prompt is None:
+                _running_prompts.discard(prompt_id)
+            elif prompt["progress"] < 100:
+                prompt["progress"] += 10
+            else:
+                # Mark as completed
+                prompt["status"] = "completed"
+                _running_prompts.discard(prompt_id)
+                print(f"[Mock Server] Completed prompt: {prompt_id}")
 
 @app.get("/history/{prompt_id}")
 async def get_history(prompt_id: str):
@@ -193,7 +270,9 @@ async def view_file(filename: str, subfolder: str = "", type: str = "output"):
         return FileResponse(
             path=SAMPLE_VIDEO,
             media_type="video/mp4",
-            filename=filename
+            filename=filename,
+            # MP4 is already compressed; keep GZipMiddleware out of the way
+            headers={"Content-Encoding": "identity"}
         )
 
     # For other files, return 404 or dummy content
@@ -225,37 +304,9 @@ async def websocket_endpoint():
     )
 
 @app.get("/object_info")
-async def get_object_info():
+async def get_object_info(request: Request):
     """Mock object info endpoint"""
-    return {
-        "KSamplerAdvanced": {
-            "input": {
-                "required": {
-                    "model": ["MODEL"],
-                    "positive": ["CONDITIONING"],
-                    "negative": ["CONDITIONING"],
-                    "latent_image": ["LATENT"],
-                    "noise_seed": ["INT", {"default": 0}],
-                    "steps": ["INT", {"default": 20}],
-                    "cfg": ["FLOAT", {"default": 8.0}],
-                    "sampler_name": ["COMBO[STRING]", {"default": "euler"}],
-                    "scheduler": ["COMBO[STRING]", {"default": "normal"}],
-                    "add_noise": ["COMBO[STRING]", {"default": "enable"}],
-                    "start_at_step": ["INT", {"default": 0}],
-                    "end_at_step": ["INT", {"default": 10000}],
-                    "return_with_leftover_noise": ["COMBO[STRING]", {"default": "disable"}]
-                }
-            },
-            "output": ["LATENT"],
-            "output_is_list": [False],
-            "output_name": ["LATENT"],
-            "name": "KSamplerAdvanced",
-            "display_name": "KSampler (Advanced)",
-            "description": "",
-            "category": "sampling",
-            "output_node": False
-        }
-    }
+    return _static_response(request, _OBJECT_INFO_BYTES, _OBJECT_INFO_ETAG)
 
 if __name__ == "__main__":
     print("=" * 60)
@@ -275,4 +326,11 @@ if __name__ == "__main__":
     print("\nNote: WebSocket (/ws) is not mocked.")
     print("=" * 60)
 
-    uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="127.0.0.1",
+        port=8001,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        log_level="warning",
+    )
\ No newline at end of file
@@ -6,29 +6,36 @@ Video Workflow Server
 """
 
 import asyncio
+import copy
 import json
 import uuid
 import time
 import logging
+import os
 import shutil
+import sys
+from collections import Counter
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Set, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
 
 import aiohttp
 import aiofiles
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 import uvicorn
 
 # ==================== 配置 ====================
 CONFIG = {
     "comfyui_url": "http://192.168.31.150:8001",
+    "comfyui_input_dir": None,  # 与ComfyUI共享文件系统时设为其input目录，直接复制文件跳过HTTP上传
     "max_concurrent_jobs": 1,
     "upload_dir": "uploads",
     "output_dir": "outputs",
@@ -36,8 +43,20 @@ CONFIG = {
     "retry_delay": 5,  # 秒
     "cleanup_old_files": True,
     "cleanup_days": 7,
+    "max_jobs": 10_000,  # 内存中保留的任务上限，超出时淘汰最早的已结束任务
+    "result_retention_minutes": 60,  # 淘汰任务时，早于此时间的结果文件一并删除
+    "ws_reconnect_delay": 10,  # 秒，ComfyUI WebSocket断开后的重连间隔
+    "ws_fallback_poll_interval": 30,  # 秒，WebSocket模式下兜底查询history的间隔
 }
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传文件分块写盘大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 从ComfyUI下载结果的分块大小
+
+# 上传文件名清洗表：路径分隔符等替换为下划线，控制字符直接删除
+_FILENAME_TRANS = str.maketrans(
+    {" ": "_", "/": "_", "\\": "_", ":": "_", **{chr(c): None for c in (*range(32), 127)}}
+)
+
 # ==================== 日志配置 ====================
 logging.basicConfig(
     level=logging.INFO,
@@ -60,6 +79,9 @@ class VideoFormat(str, Enum):
     GIF = "gif"
 
 class WorkflowConfig(BaseModel):
+    # 实例会被_build_config缓存共享，禁止修改
+    model_config = ConfigDict(frozen=True)
+
     positive_prompt: str = Field(..., description="正面提示词")
     negative_prompt: str = Field(..., description="负面提示词")
     seed: int = Field(default=88888, description="随机种子")
@@ -90,31 +112,120 @@ class Job:
         if self.created_at is None:
             self.created_at = datetime.now()
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # 任何字段变更都使序列化缓存失效
+        if name != '_cached_dict':
+            super().__setattr__('_cached_dict', None)
+
     def to_dict(self):
-        data = asdict(self)
-        data['status'] = self.status.value
-        data['created_at'] = self.created_at.isoformat() if self.created_at else None
-        data['started_at'] = self.started_at.isoformat() if self.started_at else None
-        data['completed_at'] = self.completed_at.isoformat() if self.completed_at else None
-        data['filepath'] = str(self.filepath) if self.filepath else None
-        data['result_path'] = str(self.result_path) if self.result_path else None
+        if self._cached_dict is not None:
+            return self._cached_dict
+
+        data = {
+            'id': self.id,
+            'filename': self.filename,
+            'original_filename': self.original_filename,
+            'filepath': str(self.filepath) if self.filepath else None,
+            'status': self.status.value,
+            'progress': self.progress,
+            'config': self.config.model_dump(mode='json') if self.config else None,
+            'comfy_prompt_id': self.comfy_prompt_id,
+            'result_path': str(self.result_path) if self.result_path else None,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'retry_count': self.retry_count,
+        }
+        self._cached_dict = data
         return data
 
+# ==================== 工具函数 ====================
+def _sync_cleanup(cutoff_time: float, cursor: Dict[str, Tuple[int, float, List[str]]], *roots: Path) -> int:
+    """删除早于cutoff_time的文件，供asyncio.to_thread调用
+
+    cursor记录每个目录扫描前的mtime、剩余文件中最早的mtime及其子目录；
+    目录未变化且没有文件会过期时，跳过该目录的条目扫描。
+    """
+    removed = 0
+    stack = [str(root) for root in roots]
+    while stack:
+        path = stack.pop()
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            cursor.pop(path, None)
+            continue
+
+        cached = cursor.get(path)
+        if cached and cached[0] == dir_mtime and cached[1] >= cutoff_time:
+            stack.extend(cached[2])
+            continue
+
+        oldest = float("inf")
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                    if mtime < cutoff_time:
+                        os.unlink(entry.path)
+                        removed += 1
+                    else:
+                        oldest = min(oldest, mtime)
+
+        # 使用扫描前的mtime：本次删除或并发写入都会让下次重新扫描
+        cursor[path] = (dir_mtime, oldest, subdirs)
+        stack.extend(subdirs)
+
+    return removed
+
+def _remove_stale_files(paths: List[Path], cutoff_time: float):
+    """删除mtime早于cutoff_time的文件，供asyncio.to_thread调用"""
+    for path in paths:
+        try:
+            if path.stat().st_mtime < cutoff_time:
+                path.unlink()
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+
 # ==================== 服务器状态 ====================
 class WorkflowServer:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.jobs: Dict[str, Job] = {}
+        self._status_counts: Counter[JobStatus] = Counter()
         self.job_queue: asyncio.Queue = asyncio.Queue()
         self.processing_tasks: Dict[str, asyncio.Task] = {}
+        # cancel_job在任何await之前登记，工作进程据此区分任务取消与服务器关闭
+        self._cancel_requested: Set[str] = set()
+        # 失败后等待重试（含已重新入队）的任务，不可被淘汰
+        self._retry_pending: Set[str] = set()
         self.session: Optional[aiohttp.ClientSession] = None
 
+        # ComfyUI WebSocket推送状态
+        self.client_id = uuid.uuid4().hex
+        self._ws_connected = False
+        self._completion_events: Dict[str, asyncio.Event] = {}
+        self._prompt_jobs: Dict[str, Job] = {}
+        self._prompt_errors: Dict[str, str] = {}
+
+        self._shutdown = asyncio.Event()
+        self._background_task: Optional[asyncio.Task] = None
+        self._cleanup_cursor: Dict[str, Tuple[int, float, List[str]]] = {}
+
         # 创建目录
         self.upload_dir = Path(config["upload_dir"])
         self.output_dir = Path(config["output_dir"])
         self.upload_dir.mkdir(exist_ok=True, parents=True)
         self.output_dir.mkdir(exist_ok=True, parents=True)
 
+        # 工作流模板运行期不变，启动时加载一次
+        self._workflow_template = self._load_workflow_template()
+
         logger.info(f"Workflow Server initialized")
         logger.info(f"ComfyUI URL: {config['comfyui_url']}")
         logger.info(f"Upload dir: {self.upload_dir.absolute()}")
@@ -122,40 +233,153 @@ class WorkflowServer:
 
     async def start(self):
         """启动服务器"""
-        self.session = aiohttp.ClientSession()
-        # 启动工作进程
-        for i in range(self.config["max_concurrent_jobs"]):
-            asyncio.create_task(self._worker(i + 1))
+        # Python 3.12+：新任务同步执行到第一次挂起，省去一次调度
+        if hasattr(asyncio, "eager_task_factory"):
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+        # 复用长连接：取消总连接数上限，限制单主机并发并缓存DNS
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=32,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
 
-        # 启动清理任务
-        if self.config["cleanup_old_files"]:
-            asyncio.create_task(self._cleanup_task())
+        # 后台任务统一由TaskGroup管理
+        self._start_background_tasks()
 
     async def stop(self):
         """停止服务器"""
+        self._shutdown.set()
+        if self._background_task:
+            # 取消TaskGroup所在任务，组内任务会被一并取消并等待退出
+            self._background_task.cancel()
+            await asyncio.gather(self._background_task, return_exceptions=True)
         if self.session:
             await self.session.close()
 
+    def _start_background_tasks(self):
+        """创建TaskGroup所在的监督任务，并监视其意外退出"""
+        if self._shutdown.is_set():
+            return
+        self._background_task = asyncio.create_task(self._run_background_tasks())
+        self._background_task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task):
+        """监督任务在stop()之前结束时记录错误，并在1秒后重启"""
+        if self._shutdown.is_set():
+            return
+        if task.cancelled():
+            logger.error("Background tasks cancelled unexpectedly, restarting")
+        else:
+            exc = task.exception()
+            logger.error(f"Background tasks exited unexpectedly: {exc!r}, restarting", exc_info=exc)
+        task.get_loop().call_later(1, self._start_background_tasks)
+
+    async def _run_background_tasks(self):
+        """在TaskGroup中运行WebSocket监听、工作进程和清理任务"""
+        async with asyncio.TaskGroup() as tg:
+            # 订阅ComfyUI执行事件
+            tg.create_task(self._ws_listener())
+
+            # 启动工作进程
+            for i in range(self.config["max_concurrent_jobs"]):
+                tg.create_task(self._worker(i + 1))
+
+            # 启动清理任务
+            if self.config["cleanup_old_files"]:
+                tg.create_task(self._cleanup_task())
+
+    async def _ws_listener(self):
+        """监听ComfyUI WebSocket，将执行事件分发给等待中的任务"""
+        ws_url = f"{self.config['comfyui_url']}/ws"
+        # 仅在启动时或断线后的首次失败记录WARNING，之后的重连失败降为DEBUG
+        warn_on_failure = True
+        while True:
+            try:
+                async with self.session.ws_connect(ws_url, params={"clientId": self.client_id}) as ws:
+                    self._ws_connected = True
+                    warn_on_failure = True
+                    logger.info(f"Connected to ComfyUI WebSocket: {ws_url}")
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._handle_ws_message(json.loads(msg.data))
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log = logger.warning if warn_on_failure else logger.debug
+                log(f"ComfyUI WebSocket unavailable, falling back to polling: {e}")
+                warn_on_failure = False
+            finally:
+                self._ws_connected = False
+                # 唤醒所有等待者，让其切换到轮询模式
+                for event in self._completion_events.values():
+                    event.set()
+
+            await asyncio.sleep(self.config["ws_reconnect_delay"])
+
+    def _handle_ws_message(self, message: Dict[str, Any]):
+        """处理单条ComfyUI WebSocket消息"""
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        event = self._completion_events.get(prompt_id)
+        if event is None:
+            return
+
+        if msg_type == "progress":
+            job = self._prompt_jobs.get(prompt_id)
+            if job and data.get("max"):
+                job.progress = 50 + min(30, data["value"] / data["max"] * 30)
+        elif msg_type == "executing" and data.get("node") is None:
+            event.set()
+        elif msg_type == "execution_success":
+            event.set()
+        elif msg_type in ("execution_error", "execution_interrupted"):
+            self._prompt_errors[prompt_id] = data.get("exception_message") or msg_type
+            event.set()
+
     async def _worker(self, worker_id: int):
         """工作进程，处理任务队列"""
         logger.info(f"Worker {worker_id} started")
         while True:
             try:
                 job_id = await self.job_queue.get()
+                self._retry_pending.discard(job_id)
                 job = self.jobs.get(job_id)
-                if not job:
+                if not job or job_id in self._cancel_requested:
+                    # 任务已被淘汰或在排队中被取消
+                    self._cancel_requested.discard(job_id)
+                    self.job_queue.task_done()
                     continue
 
-                # 处理任务
-                task = asyncio.create_task(self._process_job(job, worker_id))
-                self.processing_tasks[job_id] = task
+                # 直接在工作进程任务中处理，登记当前任务以便取消
+                current = asyncio.current_task()
+                self.processing_tasks[job_id] = current
 
                 try:
-                    await task
+                    await self._process_job(job, worker_id)
+                except asyncio.CancelledError:
+                    # 仅吞掉cancel_job发起的取消，其余情况继续向上抛出
+                    if job_id not in self._cancel_requested:
+                        if not self._shutdown.is_set():
+                            # 监督任务异常导致的取消：任务放回队列，由重启后的工作进程继续处理
+                            self._set_status(job, JobStatus.PENDING)
+                            job.progress = 0
+                            self.job_queue.put_nowait(job_id)
+                            logger.warning(f"Worker {worker_id} interrupted, requeued job {job_id}")
+                        raise
+                    current.uncancel()
+                    logger.info(f"Worker {worker_id} job {job_id} cancelled")
                 except Exception as e:
                     logger.error(f"Worker {worker_id} job {job_id} failed: {e}")
                 finally:
                     self.processing_tasks.pop(job_id, None)
+                    self._cancel_requested.discard(job_id)
                     self.job_queue.task_done()
 
             except Exception as e:
@@ -168,7 +392,7 @@ class WorkflowServer:
 
         try:
             # 更新状态
-            job.status = JobStatus.UPLOADING
+            self._set_status(job, JobStatus.UPLOADING)
             job.started_at = datetime.now()
             job.progress = 10
 
@@ -181,7 +405,7 @@ class WorkflowServer:
             job.progress = 40
 
             # 3. 提交到ComfyUI
-            job.status = JobStatus.PROCESSING
+            self._set_status(job, JobStatus.PROCESSING)
             prompt_id = await self._queue_workflow(workflow)
             job.comfy_prompt_id = prompt_id
             job.progress = 50
@@ -196,25 +420,38 @@ class WorkflowServer:
             job.progress = 100
 
             # 6. 标记完成
-            job.status = JobStatus.COMPLETED
+            self._set_status(job, JobStatus.COMPLETED)
             job.completed_at = datetime.now()
 
             logger.info(f"Job {job.id} completed successfully: {result_path}")
 
         except Exception as e:
             logger.error(f"Job {job.id} failed: {e}")
-            job.status = JobStatus.FAILED
+            self._set_status(job, JobStatus.FAILED)
             job.error_message = str(e)
 
             # 重试逻辑
             if job.retry_count < self.config["max_retries"]:
                 job.retry_count += 1
+                self._retry_pending.add(job.id)
                 logger.info(f"Retrying job {job.id} (attempt {job.retry_count})")
                 await asyncio.sleep(self.config["retry_delay"])
                 await self.queue_job(job.id)
 
+    def _set_status(self, job: Job, status: JobStatus):
+        """更新任务状态并同步状态计数"""
+        self._status_counts[job.status] -= 1
+        self._status_counts[status] += 1
+        job.status = status
+
     async def _upload_to_comfyui(self, filepath: Path) -> str:
         """上传图片到ComfyUI"""
+        input_dir = self.config.get("comfyui_input_dir")
+        if input_dir:
+            # 本地共享目录：直接复制到ComfyUI的input目录，无需网络往返
+            await asyncio.to_thread(shutil.copy2, filepath, Path(input_dir) / filepath.name)
+            return filepath.name
+
         url = f"{self.config['comfyui_url']}/upload/image"
 
         async with aiofiles.open(filepath, 'rb') as f:
@@ -235,22 +472,22 @@ class WorkflowServer:
             result = await response.json()
             return result['name']
 
-    def _generate_workflow(self, image_filename: str, config: WorkflowConfig) -> Dict:
-        """生成ComfyUI工作流"""
-        # 加载基础工作流模板
+    def _load_workflow_template(self) -> Dict:
+        """加载基础工作流模板，仅在初始化时调用一次"""
         workflow_path = Path("services/workflowTemplate.ts")
-        if not workflow_path.exists():
-            # 使用内置模板
-            workflow = self._get_default_workflow()
-        else:
+        if workflow_path.exists():
             # 从文件加载（简化版本）
-            with open(workflow_path, 'r') as f:
-                content = f.read()
-                # 这里需要解析TypeScript文件，简化处理
-                workflow = self._get_default_workflow()
+            # 这里需要解析TypeScript文件，简化处理：仍使用内置模板
+            logger.info(f"Workflow template: {workflow_path} (using built-in template)")
+        return self._get_default_workflow()
+
+    def _generate_workflow(self, image_filename: str, config: WorkflowConfig) -> Dict:
+        """生成ComfyUI工作流"""
+        # 基于缓存的模板生成，避免在事件循环中读文件
+        workflow = copy.deepcopy(self._workflow_template)
 
         # 应用配置
-        seed = config.seed if not config.randomize_seed else int(time.time() * 1000) % 1000000
+        seed = config.seed if not config.randomize_seed else time.monotonic_ns() // 1000 % 1_000_000
 
         # 这里应该根据实际工作流结构进行修改
         # 简化处理：返回一个基本工作流
@@ -280,7 +517,8 @@ class WorkflowServer:
         """提交工作流到ComfyUI"""
         url = f"{self.config['comfyui_url']}/prompt"
 
-        async with self.session.post(url, json={"prompt": workflow}) as response:
+        payload = {"prompt": workflow, "client_id": self.client_id}
+        async with self.session.post(url, json=payload) as response:
             if response.status != 200:
                 raise HTTPException(
                     status_code=response.status,
@@ -291,26 +529,73 @@ class WorkflowServer:
             return result['prompt_id']
 
     async def _wait_for_completion(self, prompt_id: str, job: Job):
-        """等待ComfyUI任务完成"""
+        """等待ComfyUI任务完成
+
+        WebSocket可用时由推送事件唤醒，否则每2秒查询一次history。
+        """
         history_url = f"{self.config['comfyui_url']}/history/{prompt_id}"
 
         max_wait = 300  # 5分钟超时
         start_time = time.time()
 
-        while time.time() - start_time < max_wait:
-            async with self.session.get(history_url) as response:
-                if response.status == 200:
-                    history = await response.json()
-                    if prompt_id in history and history[prompt_id].get('status') == 'completed':
-                        return
+        event = asyncio.Event()
+        self._completion_events[prompt_id] = event
+        self._prompt_jobs[prompt_id] = job
 
-                # 更新进度
-                elapsed = time.time() - start_time
-                job.progress = 50 + min(30, elapsed / max_wait * 30)
-                await asyncio.sleep(2)
+        try:
+            while time.time() - start_time < max_wait:
+                error = self._prompt_errors.get(prompt_id)
+                if error:
+                    raise RuntimeError(f"ComfyUI execution failed: {error}")
+
+                # 查询history前先清除事件，查询期间到达的推送不会被丢弃；
+                # 推送事件也可能早于注册到达，因此每轮都查询一次history
+                pushed = event.is_set() and self._ws_connected
+                event.clear()
+                if pushed or await self._is_completed(history_url, prompt_id):
+                    return
+
+                remaining = max_wait - (time.time() - start_time)
+                if self._ws_connected:
+                    timeout = min(remaining, self.config["ws_fallback_poll_interval"])
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    # 更新进度
+                    elapsed = time.time() - start_time
+                    job.progress = 50 + min(30, elapsed / max_wait * 30)
+                    await asyncio.sleep(min(2, max(remaining, 0)))
+        finally:
+            self._completion_events.pop(prompt_id, None)
+            self._prompt_jobs.pop(prompt_id, None)
+            self._prompt_errors.pop(prompt_id, None)
 
         raise TimeoutError(f"ComfyUI execution timeout for prompt {prompt_id}")
 
+    async def _is_completed(self, history_url: str, prompt_id: str) -> bool:
+        """查询history判断任务是否已完成，ComfyUI报告执行出错时抛出RuntimeError"""
+        async with self.session.get(history_url) as response:
+            if response.status != 200:
+                return False
+            history = await response.json()
+            status = history.get(prompt_id, {}).get('status')
+            # 兼容mock服务器的字符串状态与ComfyUI的状态对象
+            if isinstance(status, dict):
+                if status.get('status_str') == 'error':
+                    raise RuntimeError(f"ComfyUI execution failed: {self._history_error(status)}")
+                return bool(status.get('completed'))
+            return status == 'completed'
+
+    @staticmethod
+    def _history_error(status: Dict[str, Any]) -> str:
+        """从history状态对象的messages中提取错误信息"""
+        for msg_type, data in status.get('messages', []):
+            if msg_type in ("execution_error", "execution_interrupted"):
+                return (data or {}).get("exception_message") or msg_type
+        return "execution_error"
+
     async def _download_result(self, prompt_id: str, job: Job) -> Path:
         """下载结果文件"""
         history_url = f"{self.config['comfyui_url']}/history/{prompt_id}"
@@ -353,46 +638,49 @@ class WorkflowServer:
                     )
 
                 async with aiofiles.open(output_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(1024):
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
                         await f.write(chunk)
 
             return output_path
 
     async def _cleanup_task(self):
         """清理旧文件任务"""
-        while True:
+        while not self._shutdown.is_set():
             try:
                 cutoff_time = time.time() - (self.config["cleanup_days"] * 24 * 3600)
 
-                # 清理上传文件
-                for file in self.upload_dir.rglob("*"):
-                    if file.is_file() and file.stat().st_mtime < cutoff_time:
-                        file.unlink()
-
-                # 清理输出文件（保留最近的结果）
-                for file in self.output_dir.rglob("*"):
-                    if file.is_file() and file.stat().st_mtime < cutoff_time:
-                        file.unlink()
+                # 在线程中遍历上传与输出目录，避免阻塞事件循环
+                removed = await asyncio.to_thread(
+                    _sync_cleanup, cutoff_time, self._cleanup_cursor,
+                    self.upload_dir, self.output_dir
+                )
+                if removed:
+                    logger.info(f"Cleanup removed {removed} old files")
 
-                await asyncio.sleep(3600)  # 每小时检查一次
+                delay = 3600  # 每小时检查一次
 
             except Exception as e:
                 logger.error(f"Cleanup error: {e}")
-                await asyncio.sleep(60)
+                delay = 60
+
+            try:
+                await asyncio.wait_for(self._shutdown.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
 
     # ==================== API方法 ====================
     async def create_job(self, file: UploadFile, config: WorkflowConfig) -> str:
         """创建新任务"""
         # 保存上传文件
-        job_id = str(uuid.uuid4())
-        timestamp = int(time.time())
-        safe_filename = file.filename.replace(' ', '_').replace('/', '_')
+        job_id = uuid.uuid4().hex
+        timestamp = time.time_ns() // 1_000_000_000
+        safe_filename = file.filename.translate(_FILENAME_TRANS)
         filename = f"{timestamp}_{safe_filename}"
         filepath = self.upload_dir / filename
 
         async with aiofiles.open(filepath, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
 
         # 创建任务实例
         job = Job(
@@ -405,11 +693,44 @@ class WorkflowServer:
         )
 
         self.jobs[job_id] = job
+        self._status_counts[job.status] += 1
+        await self._evict_jobs()
         await self.job_queue.put(job_id)
 
         logger.info(f"Created job {job_id} for file {file.filename}")
         return job_id
 
+    async def _evict_jobs(self):
+        """任务数超过上限时，按创建顺序淘汰已结束的任务"""
+        excess = len(self.jobs) - self.config["max_jobs"]
+        if excess <= 0:
+            return
+
+        cutoff_time = time.time() - self.config["result_retention_minutes"] * 60
+        evicted = []
+        for job_id, job in self.jobs.items():
+            if len(evicted) >= excess:
+                break
+            # 已取消但工作进程仍在退出的任务暂不淘汰，以免状态计数漂移
+            if job_id in self.processing_tasks:
+                continue
+            finished = job.status in (JobStatus.COMPLETED, JobStatus.CANCELLED) or (
+                job.status == JobStatus.FAILED and job_id not in self._retry_pending
+            )
+            if finished:
+                evicted.append(job_id)
+
+        result_paths = []
+        for job_id in evicted:
+            job = self.jobs.pop(job_id)
+            self._status_counts[job.status] -= 1
+            if job.status == JobStatus.COMPLETED and job.result_path:
+                result_paths.append(job.result_path)
+
+        # 在线程中删除过期结果文件，避免阻塞事件循环
+        if result_paths:
+            await asyncio.to_thread(_remove_stale_files, result_paths, cutoff_time)
+
     async def queue_job(self, job_id: str):
         """将任务加入队列"""
         if job_id in self.jobs:
@@ -423,12 +744,21 @@ class WorkflowServer:
         """获取所有任务"""
         return list(self.jobs.values())
 
+    def get_status_counts(self) -> Dict[str, int]:
+        """获取各状态的任务数量"""
+        return {status.value: count for status, count in self._status_counts.items() if count}
+
     async def cancel_job(self, job_id: str) -> bool:
         """取消任务"""
         if job_id in self.jobs:
             job = self.jobs[job_id]
             if job.status in [JobStatus.PENDING, JobStatus.UPLOADING, JobStatus.PROCESSING]:
-                job.status = JobStatus.CANCELLED
+                self._set_status(job, JobStatus.CANCELLED)
+
+                # 先同步取消处理任务，避免等待ComfyUI响应期间任务继续运行并改写状态
+                self._cancel_requested.add(job_id)
+                if job_id in self.processing_tasks:
+                    self.processing_tasks[job_id].cancel()
 
                 # 取消ComfyUI任务
                 if job.comfy_prompt_id:
@@ -440,15 +770,15 @@ class WorkflowServer:
                     except Exception as e:
                         logger.error(f"Error cancelling ComfyUI prompt: {e}")
 
-                # 取消处理任务
-                if job_id in self.processing_tasks:
-                    self.processing_tasks[job_id].cancel()
-
                 return True
         return False
 
 # ==================== FastAPI应用 ====================
-app = FastAPI(title="Video Workflow Server", version="1.0.0")
+app = FastAPI(
+    title="Video Workflow Server",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS配置
 app.add_middleware(
@@ -459,6 +789,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 压缩较大的JSON响应（使用最快压缩级别）
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
 # 服务器实例
 server = None
 
@@ -484,28 +817,50 @@ async def root():
         "comfyui_url": CONFIG["comfyui_url"]
     }
 
-@app.post("/api/jobs")
-async def create_job(
-    file: UploadFile = File(...),
+def workflow_config_form(
     positive_prompt: str = Form(...),
     negative_prompt: str = Form(...),
     seed: int = Form(88888),
     randomize_seed: bool = Form(True),
-    fps: int = Form(16),
-    duration: int = Form(5),
+    fps: int = Form(16, ge=1, le=60),
+    duration: int = Form(5, ge=1, le=30),
     format: VideoFormat = Form(VideoFormat.MP4)
-):
-    """创建新视频处理任务"""
-    config = WorkflowConfig(
+) -> WorkflowConfig:
+    """从表单字段构建工作流配置
+
+    表单参数已由FastAPI按WorkflowConfig的约束校验，这里直接构造模型，不再重复校验。
+    """
+    return _build_config(
+        positive_prompt, negative_prompt, seed, randomize_seed, fps, duration, format.value
+    )
+
+@lru_cache(maxsize=1024)
+def _build_config(
+    positive_prompt: str,
+    negative_prompt: str,
+    seed: int,
+    randomize_seed: bool,
+    fps: int,
+    duration: int,
+    format: str
+) -> WorkflowConfig:
+    """按表单取值缓存配置实例，相同参数的上传共享同一个冻结模型"""
+    return WorkflowConfig.model_construct(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         seed=seed,
         randomize_seed=randomize_seed,
         fps=fps,
         duration=duration,
-        format=format
+        format=VideoFormat(format)
     )
 
+@app.post("/api/jobs")
+async def create_job(
+    file: UploadFile = File(...),
+    config: WorkflowConfig = Depends(workflow_config_form)
+):
+    """创建新视频处理任务"""
     job_id = await server.create_job(file, config)
     return {"job_id": job_id, "status": "queued"}
 
@@ -513,7 +868,7 @@ async def create_job(
 async def list_jobs():
     """获取所有任务"""
     jobs = await server.get_all_jobs()
-    return {"jobs": [job.to_dict() for job in jobs]}
+    return ORJSONResponse(content={"jobs": [job.to_dict() for job in jobs]})
 
 @app.get("/api/jobs/{job_id}")
 async def get_job(job_id: str):
@@ -544,22 +899,17 @@ async def get_job_result(job_id: str):
     return FileResponse(
         path=job.result_path,
         filename=f"result_{job.original_filename}.mp4",
-        media_type="video/mp4"
+        media_type="video/mp4",
+        # MP4本身已压缩，跳过GZip中间件
+        headers={"Content-Encoding": "identity"}
     )
 
 @app.get("/api/stats")
 async def get_stats():
     """获取服务器统计信息"""
-    jobs = await server.get_all_jobs()
-
-    status_counts = {}
-    for job in jobs:
-        status = job.status.value
-        status_counts[status] = status_counts.get(status, 0) + 1
-
     return {
-        "total_jobs": len(jobs),
-        "status_counts": status_counts,
+        "total_jobs": len(server.jobs),
+        "status_counts": server.get_status_counts(),
         "queue_size": server.job_queue.qsize(),
         "processing_tasks": len(server.processing_tasks)
     }
@@ -568,10 +918,12 @@ async def get_stats():
 async def health_check():
     """健康检查"""
     try:
-        # 检查ComfyUI连接
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{CONFIG['comfyui_url']}/system_stats") as response:
-                comfy_ok = response.status == 200
+        # 检查ComfyUI连接（复用共享会话，快速失败）
+        async with server.session.get(
+            f"{CONFIG['comfyui_url']}/system_stats",
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            comfy_ok = response.status == 200
     except:
         comfy_ok = False
 
@@ -598,4 +950,11 @@ if __name__ == "__main__":
     print("  GET  /api/health    - 健康检查")
     print("=" * 60)
 
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="127.0.0.1",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        log_level="warning",
+    )
\ No newline at end of file